@@ -0,0 +1,202 @@
+# 每日快照歸檔與歷史查詢
+#
+# 每次執行 main.py 會寫入 snapshots/YYYY-MM-DD/，每個欄位一個 .npy 檔 (可 mmap，只讀需要的欄)：
+#   id.npy        股票代號 (已排序，可二分搜尋)
+#   <欄位>.npy    數值欄位 (pe, yield, roe_avg ...)
+#   tags.npy      標籤位元遮罩，第 k 位對應 meta.json 的 tags[k]
+#
+# 另外同步附加到 snapshots/_series/ (單一股票的時間序列只需一次 mmap 讀取)：
+#   <欄位>.f32    每日一列 float32 依序附加，第 k 列寬度為 index.json 的 widths[k]
+#   index.json    {"dates": [...], "widths": [...], "ids": [...]}，ids 的位置 (slot) 只增不減
+# _series 只是每日快照的衍生索引，不進 git；缺少或與快照不一致時會自動由快照重建
+#
+# 用法:
+#   python history.py field 2330 yield_avg --since 2024-10-01
+#   python history.py gained 🏆黃金存股 --since 2026-10-12
+#   python history.py rebuild    (由每日快照重建 _series)
+
+import os
+import json
+import argparse
+import numpy as np
+from datetime import datetime, timedelta
+
+HISTORY_DIR = "snapshots"
+SERIES_DIR = "_series"
+
+def write_snapshot(store, tag_labels, date, root=HISTORY_DIR):
+    """把 StockStore 的數值欄位與標籤寫成當日快照，回傳快照目錄。"""
+    path = os.path.join(root, date)
+    os.makedirs(path, exist_ok=True)
+
+    ids = np.asarray(store['id'], dtype=str)
+    order = np.argsort(ids, kind='stable')
+    np.save(os.path.join(path, "id.npy"), ids[order])
+
+    fields = []
+    for name, col in store.columns.items():
+        if col.dtype.kind == 'f': col = col.astype(np.float32)
+        elif col.dtype.kind not in 'ib': continue
+        np.save(os.path.join(path, f"{name}.npy"), col[order])
+        fields.append(name)
+
+    bit = {label: np.uint32(1 << k) for k, label in enumerate(tag_labels)}
+    tags = np.zeros(len(ids), dtype=np.uint32)
+    for i, row_tags in enumerate(store['tags']):
+        for label in row_tags: tags[i] |= bit.get(label, 0)
+    np.save(os.path.join(path, "tags.npy"), tags[order])
+
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"date": date, "rows": len(ids), "fields": fields, "tags": list(tag_labels)}, f, ensure_ascii=False)
+
+    # 序列與既有快照日期一致才直接附加，否則 (例如新 checkout 沒有 _series) 整個重建
+    series_dates = load_series_index(root)["dates"]
+    if series_dates == [d for d in list_dates(None, None, root) if d != date] or series_dates == list_dates(None, None, root):
+        append_series(date, ids, {name: store.columns[name] for name in fields}, root)
+    else:
+        rebuild_series(root)
+    return path
+
+def load_series_index(root=HISTORY_DIR):
+    try:
+        with open(os.path.join(root, SERIES_DIR, "index.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"dates": [], "widths": [], "ids": []}
+
+def append_series(date, ids, columns, root=HISTORY_DIR):
+    """把當日各欄位附加到 _series/<欄位>.f32；同一天重跑會先移除舊的那一列。"""
+    path = os.path.join(root, SERIES_DIR)
+    os.makedirs(path, exist_ok=True)
+    index = load_series_index(root)
+    if index["dates"] and date <= index["dates"][-1]:
+        if date < index["dates"][-1]: raise ValueError(f"快照日期 {date} 早於序列最後一天 {index['dates'][-1]}，請用 rebuild")
+        index["dates"].pop(); index["widths"].pop()
+    offset = sum(index["widths"]) * 4
+
+    slot = {sid: i for i, sid in enumerate(index["ids"])}
+    for sid in ids:
+        if sid not in slot:
+            slot[sid] = len(index["ids"]); index["ids"].append(sid)
+    width = len(index["ids"])
+    rows = np.array([slot[sid] for sid in ids], dtype=np.int64)
+
+    kinds = index.setdefault("kinds", {})
+    for name, col in columns.items():
+        col = np.asarray(col)
+        kinds[name] = col.dtype.kind
+        row = np.full(width, np.nan, dtype=np.float32)
+        row[rows] = col.astype(np.float32)
+        file = os.path.join(path, f"{name}.f32")
+        with open(file, "r+b" if os.path.exists(file) else "w+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            # 新欄位或中途缺席的欄位：以 NaN 補齊先前的列，維持與 widths 對齊
+            if size < offset: f.write(np.full((offset - size) // 4, np.nan, dtype=np.float32).tobytes())
+            else: f.truncate(offset)
+            f.seek(offset); f.write(row.tobytes())
+
+    index["dates"].append(date); index["widths"].append(width)
+    with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+
+def rebuild_series(root=HISTORY_DIR):
+    """由每日快照目錄重新產生 _series (例如舊歸檔或序列損毀時)。"""
+    path = os.path.join(root, SERIES_DIR)
+    if os.path.isdir(path):
+        for name in os.listdir(path): os.remove(os.path.join(path, name))
+    for d in list_dates(None, None, root):
+        fields = load_meta(d, root)["fields"]
+        append_series(d, load_column(d, "id", root), {name: load_column(d, name, root) for name in fields}, root)
+
+def list_dates(since=None, until=None, root=HISTORY_DIR):
+    if not os.path.isdir(root): return []
+    dates = sorted(d for d in os.listdir(root) if os.path.isfile(os.path.join(root, d, "meta.json")))
+    return [d for d in dates if (since is None or d >= since) and (until is None or d <= until)]
+
+def load_column(date, field, root=HISTORY_DIR):
+    return np.load(os.path.join(root, date, f"{field}.npy"), mmap_mode='r')
+
+def load_meta(date, root):
+    with open(os.path.join(root, date, "meta.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _row_of(ids, stock_id):
+    i = int(np.searchsorted(ids, stock_id))
+    return i if i < len(ids) and ids[i] == stock_id else None
+
+def _to_python(v, kind):
+    """NumPy 值轉回 Python 型別；float32 以最短表示法轉換，避免 1.7 變成 1.7000000476837158。"""
+    if kind in 'iu': return int(v)
+    if kind == 'b': return bool(v)
+    return float(str(v))
+
+def _series_history(stock_id, field, since, until, root):
+    index = load_series_index(root)
+    path = os.path.join(root, SERIES_DIR, f"{field}.f32")
+    if stock_id not in index["ids"] or not os.path.exists(path): return None
+    j = index["ids"].index(stock_id)
+    dates = np.array(index["dates"])
+    widths = np.array(index["widths"], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(widths)[:-1]))
+    keep = (widths > j) & (dates >= (since or "")) & (dates <= (until or "9999"))
+    mm = np.memmap(path, dtype=np.float32, mode='r')
+    pos = starts[keep] + j
+    pos_ok = pos < len(mm)
+    values = mm[pos[pos_ok]]
+    kind = index.get("kinds", {}).get(field, 'f')
+    return [(d, _to_python(v, kind)) for d, v in zip(dates[keep][pos_ok].tolist(), values) if v == v]
+
+def field_history(stock_id, field, since=None, until=None, root=HISTORY_DIR):
+    """單一股票某欄位的歷史：[(日期, 值), ...]，缺資料的日子略過。
+    有 _series 時只讀一個檔；否則逐日開啟快照 (兩年約需數百毫秒)。"""
+    series = _series_history(stock_id, field, since, until, root)
+    if series is not None: return series
+    out = []
+    for d in list_dates(since, until, root):
+        if not os.path.exists(os.path.join(root, d, f"{field}.npy")): continue
+        i = _row_of(load_column(d, "id", root), stock_id)
+        if i is None: continue
+        col = load_column(d, field, root)
+        if col[i] != col[i]: continue
+        out.append((d, _to_python(col[i], col.dtype.kind)))
+    return out
+
+def tag_members(label, date, root=HISTORY_DIR):
+    """某日帶有指定標籤的股票代號集合。"""
+    labels = load_meta(date, root)["tags"]
+    if label not in labels: return set()
+    mask = (load_column(date, "tags", root) & np.uint32(1 << labels.index(label))) != 0
+    return set(load_column(date, "id", root)[mask].tolist())
+
+def tag_changes(label, since, until=None, root=HISTORY_DIR):
+    """比較 since 前最後一份與期間內最後一份快照，回傳 (新取得標籤, 失去標籤)。"""
+    dates = list_dates(None, until, root)
+    if not dates: return set(), set()
+    before = [d for d in dates if d <= since]
+    start = before[-1] if before else dates[0]
+    old, new = tag_members(label, start, root), tag_members(label, dates[-1], root)
+    return new - old, old - new
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查詢每日快照歷史")
+    parser.add_argument("--root", default=HISTORY_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("field", help="單一股票欄位歷史")
+    p.add_argument("stock_id"); p.add_argument("field")
+    p.add_argument("--since"); p.add_argument("--until")
+    sub.add_parser("rebuild", help="由每日快照重建 _series")
+    p = sub.add_parser("gained", help="期間內新取得 / 失去某標籤的股票")
+    p.add_argument("label")
+    p.add_argument("--since", default=(datetime.utcnow() + timedelta(hours=8) - timedelta(days=7)).strftime('%Y-%m-%d'))
+    p.add_argument("--until")
+    args = parser.parse_args()
+
+    if args.cmd == "field":
+        for d, v in field_history(args.stock_id, args.field, args.since, args.until, args.root): print(f"{d}\t{v}")
+    elif args.cmd == "rebuild":
+        rebuild_series(args.root)
+        print(f"✅ 已重建 {os.path.join(args.root, SERIES_DIR)}")
+    else:
+        gained, lost = tag_changes(args.label, args.since, args.until, args.root)
+        print(f"➕ 新增 ({len(gained)}): {' '.join(sorted(gained))}")
+        print(f"➖ 移除 ({len(lost)}): {' '.join(sorted(lost))}")
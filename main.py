@@ -4,6 +4,11 @@
 
 import subprocess
 import sys
+import os
+import glob
+import hashlib
+import tempfile
+import zlib
 import json
 import time
 import requests
@@ -38,21 +43,160 @@ except ImportError:
     from fake_useragent import UserAgent
 
 import yfinance as yf
+from history import write_snapshot
+from rules import load_rules, rule_mask
 
 # 1. 設定環境
 warnings.simplefilter(action='ignore', category=FutureWarning)
 yf_logger = logging.getLogger('yfinance')
 yf_logger.setLevel(logging.CRITICAL)
 
-class NpEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer): return int(obj)
-        elif isinstance(obj, np.floating):
-            if np.isnan(obj): return None
-            return float(obj)
-        elif isinstance(obj, np.ndarray): return obj.tolist()
-        elif isinstance(obj, np.bool_): return bool(obj)
-        else: return super(NpEncoder, self).default(obj)
+# 欄位定義：(名稱, dtype, 預設值)。順序即輸出 JSON 的欄位順序
+STOCK_SCHEMA = [
+    ("id", object, ""), ("name", object, ""),
+    ("price", np.float64, 0), ("vol", np.int64, 0),
+    ("sparkline", object, list), ("ma_bull", np.bool_, False),
+    ("eps_ttm", np.float64, 0), ("eps_avg", np.float64, 0),
+    ("roe_ttm", np.float64, 0), ("roe_avg", np.float64, 0), ("roa", np.float64, 0),
+    ("gross_margin", np.float64, 0), ("op_margin", np.float64, 0),
+    ("pe", np.float64, 0), ("pb", np.float64, 0), ("yield", np.float64, 0), ("yield_avg", np.float64, 0),
+    ("rev_growth", np.float64, 0), ("cons_div", np.int64, 0),
+    ("core_purity", np.float64, 0),
+    ("gm_stability", np.float64, 999),
+    ("payout_ratio", np.float64, 0),
+    ("tier", np.int8, 0), ("tier2_at", object, ""),
+    ("tags", object, list),
+]
+JSON_CHUNK_ROWS = 500
+
+def _object_column(values):
+    # 逐格填入，避免 np.array 把等長的 list 展開成二維陣列
+    arr = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values): arr[i] = v
+    return arr
+
+class StockStore:
+    """以欄為單位 (每欄一個 NumPy 陣列) 保存所有股票資料，取代 dict-of-dicts。"""
+
+    def __init__(self, tickers, **columns):
+        self.tickers = list(tickers)
+        self.index = {t: i for i, t in enumerate(self.tickers)}
+        n = len(self.tickers)
+        self.columns = {}
+        for name, dtype, default in STOCK_SCHEMA:
+            values = columns.get(name)
+            if dtype is object:
+                if values is None: values = [default() if callable(default) else default for _ in range(n)]
+                self.columns[name] = _object_column(values)
+            elif values is None:
+                self.columns[name] = np.full(n, default, dtype=dtype)
+            else:
+                self.columns[name] = np.asarray(values, dtype=dtype)
+
+    def __len__(self): return len(self.tickers)
+    def __contains__(self, ticker): return ticker in self.index
+    def __getitem__(self, name): return self.columns[name]
+
+    def update(self, ticker, stats):
+        i = self.index[ticker]
+        for k, v in stats.items():
+            col = self.columns[k]
+            if v is None and col.dtype.kind == 'f': v = np.nan
+            col[i] = v
+
+    def write_json(self, f):
+        """直接把各欄分段編碼寫入檔案：{"id": [...], "price": [...], ...}，不組出整份 JSON 字串。"""
+        n = len(self)
+        f.write("{")
+        for j, (name, _, _) in enumerate(STOCK_SCHEMA):
+            col = self.columns[name]
+            f.write((", " if j else "") + json.dumps(name) + ": [")
+            for start in range(0, n, JSON_CHUNK_ROWS):
+                vals = col[start:start + JSON_CHUNK_ROWS].tolist()
+                if col.dtype.kind == 'f': vals = [None if v != v else v for v in vals]
+                f.write(("," if start else "") + json.dumps(vals, ensure_ascii=False)[1:-1])
+            f.write("]")
+        f.write("}")
+
+# 篩選/標籤規則：Python 標籤與網頁「一鍵套用」共用同一份 rules.json (見 rules.py)
+RULES = load_rules()
+
+# ENRICH_MODE = "full"   : 每檔都抓 info + 財報/資產負債表/15年配息 (原本行為)
+# ENRICH_MODE = "tiered" : Tier 1 只抓 info，通過 rules.json 的 tier2_gates 或輪到更新者才進 Tier 2 抓財報
+ENRICH_MODE = os.environ.get("ENRICH_MODE", "full")
+if ENRICH_MODE not in ("full", "tiered"):
+    raise ValueError(f"ENRICH_MODE 只能是 full 或 tiered，收到: {ENRICH_MODE!r}")
+
+def apply_tags(store, where, rule_defs=RULES):
+    """一次性為 where 遮罩內的股票計算標籤 (每條規則一次陣列運算)。"""
+    tags = [[] for _ in range(len(store))]
+    for tag in rule_defs['tags']:
+        rules = rule_defs['strategies'][tag['strategy']]['rules'] if 'strategy' in tag else tag['rules']
+        for i in np.flatnonzero(rule_mask(store, rules) & where):
+            tags[i].append(tag['label'])
+    store.columns['tags'] = _object_column(tags)
+
+# ==========================================
+# 0. 靜態資源：建置時產生 Tailwind CSS，JS 固定版本並自行託管 (檔名帶內容雜湊，可長期快取)
+# ==========================================
+#    本機 / Colab 執行時，找不到 Tailwind CLI 或下載失敗會退回 CDN；
+#    設定 TAILWIND_BIN 時任何建置失敗都直接中止，避免悄悄發佈執行期 JIT 版本。
+#    JS 下載與 CLI 檢查在抓股價前完成，失敗只需數秒而非跑完整個流程才中止。
+ASSETS_DIR = "assets"
+REQUIRE_BUILD_ASSETS = bool(os.environ.get("TAILWIND_BIN"))
+TAILWIND_BIN = os.environ.get("TAILWIND_BIN", "./tailwindcss")
+TAILWIND_CDN = '<script src="https://cdn.tailwindcss.com"></script>'
+JS_ASSETS = {
+    "__LUCIDE_SRC__": ("lucide-0.460.0", "https://unpkg.com/lucide@0.460.0/dist/umd/lucide.min.js"),
+    "__ALPINE_SRC__": ("alpinejs-3.13.3", "https://cdnjs.cloudflare.com/ajax/libs/alpinejs/3.13.3/cdn.min.js"),
+}
+
+def write_hashed_asset(prefix, ext, content):
+    """寫入 assets/<prefix>.<hash>.<ext>，並刪除同 prefix 的舊版本，回傳相對路徑。"""
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    filename = f"{prefix}.{hashlib.sha256(content).hexdigest()[:10]}.{ext}"
+    for old in glob.glob(os.path.join(ASSETS_DIR, f"{prefix}.*.{ext}")):
+        if os.path.basename(old) != filename: os.remove(old)
+    with open(os.path.join(ASSETS_DIR, filename), "wb") as f:
+        f.write(content)
+    return f"{ASSETS_DIR}/{filename}"
+
+def build_tailwind_css(template):
+    """只掃描 html_template 本身 (不含股票資料) 產生精簡後的 CSS。"""
+    if not os.path.exists(TAILWIND_BIN):
+        if REQUIRE_BUILD_ASSETS: raise FileNotFoundError(f"找不到 Tailwind CLI: {TAILWIND_BIN}")
+        return None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            src, out = os.path.join(tmp, "template.html"), os.path.join(tmp, "app.css")
+            with open(src, "w", encoding="utf-8") as f: f.write(template)
+            subprocess.run([TAILWIND_BIN, "--content", src, "--minify", "-o", out], check=True, capture_output=True, timeout=120)
+            with open(out, "rb") as f:
+                return write_hashed_asset("app", "css", f.read())
+    except Exception as e:
+        if REQUIRE_BUILD_ASSETS: raise
+        print(f"Tailwind Error: {e}")
+        return None
+
+def fetch_js_asset(prefix, url):
+    existing = sorted(glob.glob(os.path.join(ASSETS_DIR, f"{prefix}.*.js")))
+    if existing: return f"{ASSETS_DIR}/{os.path.basename(existing[-1])}"
+    try:
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        return write_hashed_asset(prefix, "js", r.content)
+    except Exception as e:
+        if REQUIRE_BUILD_ASSETS: raise
+        print(f"Asset Error ({prefix}): {e}")
+        return url
+
+def preflight_assets():
+    if REQUIRE_BUILD_ASSETS:
+        if not os.path.exists(TAILWIND_BIN): raise FileNotFoundError(f"找不到 Tailwind CLI: {TAILWIND_BIN}")
+        subprocess.run([TAILWIND_BIN, "--help"], check=True, capture_output=True, timeout=60)
+    return {placeholder: fetch_js_asset(prefix, url) for placeholder, (prefix, url) in JS_ASSETS.items()}
+
+asset_tags = preflight_assets()
 
 # ==========================================
 # 1. 取得全台股清單
@@ -98,14 +242,15 @@ print(f"📋 共取得 {len(all_stocks)} 檔股票。")
 # ==========================================
 print("\n📥 [2/4] 啟動批次股價下載 (Chunk Size: 100)...")
 
-processed_data = {}
+price_tickers = []
+price_cols = {k: [] for k in ("id", "name", "price", "vol", "sparkline", "ma_bull")}
 BATCH_SIZE = 100
 chunks = [all_stocks[i:i + BATCH_SIZE] for i in range(0, len(all_stocks), BATCH_SIZE)]
 total_batches = len(chunks)
 
 for i, chunk in enumerate(chunks):
     tickers = [s['ticker'] for s in chunk]
-    sys.stdout.write(f"\r   - 批次 {i+1}/{total_batches} (已成功: {len(processed_data)} 檔)   ")
+    sys.stdout.write(f"\r   - 批次 {i+1}/{total_batches} (已成功: {len(price_tickers)} 檔)   ")
     sys.stdout.flush()
     
     try:
@@ -131,201 +276,289 @@ for i, chunk in enumerate(chunks):
                 price = round(close[-1], 2)
                 ma20 = sum(close[-20:]) / 20 if len(close) >= 20 else 0
                 
-                processed_data[t] = {
-                    "id": stock['id'], "name": stock['name'],
-                    "price": price, "vol": vol,
-                    "sparkline": [round(x, 2) for x in close], 
-                    "ma_bull": price > ma20,
-                    "eps_ttm": 0, "eps_avg": 0, 
-                    "roe_ttm": 0, "roe_avg": 0, "roa": 0,
-                    "gross_margin": 0, "op_margin": 0, 
-                    "pe": 0, "pb": 0, "yield": 0, "yield_avg": 0,
-                    "rev_growth": 0, "cons_div": 0,
-                    "core_purity": 0, 
-                    "gm_stability": 999, 
-                    "payout_ratio": 0, 
-                    "tags": [] 
-                }
+                # 其餘欄位由 STOCK_SCHEMA 的預設值補齊
+                price_tickers.append(t)
+                price_cols["id"].append(stock['id']); price_cols["name"].append(stock['name'])
+                price_cols["price"].append(price); price_cols["vol"].append(vol)
+                price_cols["sparkline"].append([round(x, 2) for x in close])
+                price_cols["ma_bull"].append(price > ma20)
             except: continue
     except: pass
 
-print(f"\n✅ 股價獲取完成！有效: {len(processed_data)} 檔")
+stock_store = StockStore(price_tickers, **price_cols)
+del price_cols
+print(f"\n✅ 股價獲取完成！有效: {len(stock_store)} 檔")
 
 # ==========================================
 # 3. 深層挖掘財報
 # ==========================================
-print("\n📥 [3/4] 正在深層挖掘財報數據 (含V2.2新增濾鏡)...")
-print("   ⚠️ 需計算3年毛利變動與本業比重，預計需 40~60 分鐘。")
-
-def fetch_deep_stats(ticker):
-    time.sleep(random.uniform(1.0, 3.0))
-    
+TIER2_GATES = RULES['tier2_gates']
+TIER2_REFRESH_DAYS = 7
+TIER1_FIELDS = ["pe", "pb", "yield", "yield_avg", "eps_ttm", "roe_ttm", "roa", "gross_margin", "op_margin", "rev_growth", "payout_ratio"]
+TIER2_FIELDS = ["eps_avg", "core_purity", "gm_stability", "roe_avg", "cons_div"]
+PREV_DB_PATH = "index.html"
+
+print(f"\n📥 [3/4] 正在深層挖掘財報數據 (模式: {ENRICH_MODE})...")
+if ENRICH_MODE == "tiered":
+    print("   ⚡ 分層模式：先抓基本面，僅通過門檻或到期的股票才抓完整財報。")
+else:
+    print("   ⚠️ 需計算3年毛利變動與本業比重，預計需 40~60 分鐘。")
+
+def load_previous_db(path=PREV_DB_PATH):
+    """從上一版 index.html 取回 stocks 陣列，供 Tier 2 欄位沿用。"""
     try:
-        stock = yf.Ticker(ticker)
-        try:
-            info = stock.info
-        except:
-            time.sleep(2)
-            stock = yf.Ticker(ticker)
-            info = stock.info
-
-        pe = round(info.get('trailingPE', 0), 2)
-        pb = round(info.get('priceToBook', 0), 2)
-        eps_ttm = info.get('trailingEps', 0)
-        roe_ttm = round(info.get('returnOnEquity', 0) * 100, 2)
-        roa = round(info.get('returnOnAssets', 0) * 100, 2)
-        gross_margin = round(info.get('grossMargins', 0) * 100, 2)
-        op_margin = round(info.get('operatingMargins', 0) * 100, 2)
-        rev_growth = round(info.get('revenueGrowth', 0) * 100, 2)
-        payout_ratio = round(info.get('payoutRatio', 0) * 100, 2) if info.get('payoutRatio') else 0
-
-        div_yield = 0
-        if info.get('dividendRate') and info.get('regularMarketPrice'):
-             div_yield = round((info['dividendRate'] / info['regularMarketPrice']) * 100, 2)
-        
-        yield_avg = info.get('fiveYearAvgDividendYield', 0)
-        if yield_avg is None: yield_avg = 0
-        else: yield_avg = round(yield_avg, 2)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("stocks: ["):
+                    return {s['id']: s for s in json.loads(line[len("stocks: "):].rstrip(','))}
+                if line.startswith("stocks: expandColumns("):
+                    cols = json.loads(line[len("stocks: expandColumns("):].rstrip(',').rstrip(')'))
+                    return {s['id']: s for s in (dict(zip(cols, vals)) for vals in zip(*cols.values()))}
+    except: pass
+    return {}
+
+def is_tier2_due(stock_id, prev, today):
+    """未過門檻的股票依代號分散到 TIER2_REFRESH_DAYS 天輪流更新，避免同一天全部到期。
+    超過兩個週期未更新 (例如漏跑) 則不論輪值一律更新。"""
+    if not prev or not prev.get('tier2_at'): return True
+    try: last = datetime.strptime(prev['tier2_at'], '%Y-%m-%d').date()
+    except: return True
+    if (today - last).days >= 2 * TIER2_REFRESH_DAYS: return True
+    return zlib.crc32(stock_id.encode()) % TIER2_REFRESH_DAYS == today.toordinal() % TIER2_REFRESH_DAYS and last < today
+
+def carry_forward_tier2(ticker, prev):
+    """沿用上次 Tier 2 的財報欄位 (未到期，或本次 Tier 2 抓取失敗時)。"""
+    if prev and prev.get('tier2_at'):
+        stock_store.update(ticker, {k: prev[k] for k in TIER2_FIELDS + ["tier2_at"] if k in prev})
+
+def fetch_basic_stats(info):
+    """Tier 1：只用 info 欄位，成本低。"""
+    pe = round(info.get('trailingPE', 0), 2)
+    pb = round(info.get('priceToBook', 0), 2)
+    eps_ttm = info.get('trailingEps', 0)
+    roe_ttm = round(info.get('returnOnEquity', 0) * 100, 2)
+    roa = round(info.get('returnOnAssets', 0) * 100, 2)
+    gross_margin = round(info.get('grossMargins', 0) * 100, 2)
+    op_margin = round(info.get('operatingMargins', 0) * 100, 2)
+    rev_growth = round(info.get('revenueGrowth', 0) * 100, 2)
+    payout_ratio = round(info.get('payoutRatio', 0) * 100, 2) if info.get('payoutRatio') else 0
+
+    div_yield = 0
+    if info.get('dividendRate') and info.get('regularMarketPrice'):
+         div_yield = round((info['dividendRate'] / info['regularMarketPrice']) * 100, 2)
+    
+    yield_avg = info.get('fiveYearAvgDividendYield', 0)
+    if yield_avg is None: yield_avg = 0
+    else: yield_avg = round(yield_avg, 2)
+
+    return {
+        "pe": pe, "pb": pb, "yield": div_yield, "yield_avg": yield_avg,
+        "eps_ttm": eps_ttm, "roe_ttm": roe_ttm,
+        "roa": roa, "gross_margin": gross_margin, "op_margin": op_margin,
+        "rev_growth": rev_growth, "payout_ratio": payout_ratio
+    }
+
+def fetch_statement_stats(stock, basic, strict=False):
+    """Tier 2：損益表、資產負債表與 15 年配息紀錄，成本高。"""
+    eps_ttm = basic.get('eps_ttm', 0)
+    roe_ttm = basic.get('roe_ttm', 0)
+    div_yield = basic.get('yield', 0)
+
+    income = pd.DataFrame()
+    try: income = stock.income_stmt
+    except: pass
+    if income.empty and strict: return None  # 分層模式：沒抓到財報視為失敗，交由呼叫端沿用舊值
 
-        income = pd.DataFrame()
-        try: income = stock.income_stmt
+    eps_avg = 0
+    if not income.empty:
+        try:
+            if 'Basic EPS' in income.index:
+                eps_series = income.loc['Basic EPS'].head(5).dropna()
+                if len(eps_series) > 0: eps_avg = round(eps_series.mean(), 2)
+            elif 'Diluted EPS' in income.index:
+                eps_series = income.loc['Diluted EPS'].head(5).dropna()
+                if len(eps_series) > 0: eps_avg = round(eps_series.mean(), 2)
+        except: eps_avg = eps_ttm
+    else: eps_avg = eps_ttm
+
+    core_purity = 0
+    if not income.empty:
+        try:
+            op_inc = income.loc['Operating Income'].iloc[0]
+            pretax = income.loc['Pretax Income'].iloc[0]
+            if pretax > 0: core_purity = round((op_inc / pretax) * 100, 2)
         except: pass
 
-        eps_avg = 0
-        if not income.empty:
-            try:
-                if 'Basic EPS' in income.index:
-                    eps_series = income.loc['Basic EPS'].head(5).dropna()
-                    if len(eps_series) > 0: eps_avg = round(eps_series.mean(), 2)
-                elif 'Diluted EPS' in income.index:
-                    eps_series = income.loc['Diluted EPS'].head(5).dropna()
-                    if len(eps_series) > 0: eps_avg = round(eps_series.mean(), 2)
-            except: eps_avg = eps_ttm
-        else: eps_avg = eps_ttm
-
-        core_purity = 0
-        if not income.empty:
-            try:
-                op_inc = income.loc['Operating Income'].iloc[0]
-                pretax = income.loc['Pretax Income'].iloc[0]
-                if pretax > 0: core_purity = round((op_inc / pretax) * 100, 2)
-            except: pass
-
-        gm_stability = 999
-        if not income.empty:
-            try:
-                gp_rows = income.loc['Gross Profit'].head(3)
-                rev_rows = income.loc['Total Revenue'].head(3)
-                if len(gp_rows) >= 3 and len(rev_rows) >= 3:
-                    margins = []
-                    for i in range(3):
-                        if rev_rows.iloc[i] > 0: margins.append((gp_rows.iloc[i] / rev_rows.iloc[i]) * 100)
-                    if len(margins) == 3: gm_stability = round(max(margins) - min(margins), 2)
-            except: pass
-
-        roe_avg = 0
+    gm_stability = 999
+    if not income.empty:
         try:
-            bs = stock.balance_sheet
-            if not bs.empty and not income.empty:
-                ni = income.loc['Net Income']
-                eq_key = next((k for k in bs.index if 'Stockholders Equity' in k or 'Total Equity' in k), None)
-                if eq_key:
-                    eq = bs.loc[eq_key]
-                    roe_series = (ni / eq) * 100
-                    recent_roe = roe_series.head(5).dropna()
-                    if len(recent_roe) > 0: roe_avg = round(recent_roe.mean(), 2)
+            gp_rows = income.loc['Gross Profit'].head(3)
+            rev_rows = income.loc['Total Revenue'].head(3)
+            if len(gp_rows) >= 3 and len(rev_rows) >= 3:
+                margins = []
+                for i in range(3):
+                    if rev_rows.iloc[i] > 0: margins.append((gp_rows.iloc[i] / rev_rows.iloc[i]) * 100)
+                if len(margins) == 3: gm_stability = round(max(margins) - min(margins), 2)
         except: pass
-        if roe_avg == 0: roe_avg = roe_ttm
 
-        cons_div = 0
-        try:
-            divs = stock.history(period="15y")['Dividends']
-            if not divs.empty:
-                yearly_divs = divs.groupby(divs.index.year).sum()
-                current_y = datetime.now().year
-                check_year = current_y - 1
-                if check_year not in yearly_divs.index or yearly_divs.loc[check_year] == 0:
-                    if (check_year - 1) in yearly_divs.index and yearly_divs.loc[check_year - 1] > 0:
-                        check_year -= 1
-                while check_year in yearly_divs.index and yearly_divs.loc[check_year] > 0:
-                    cons_div += 1
+    roe_avg = 0
+    try:
+        bs = stock.balance_sheet
+        if not bs.empty and not income.empty:
+            ni = income.loc['Net Income']
+            eq_key = next((k for k in bs.index if 'Stockholders Equity' in k or 'Total Equity' in k), None)
+            if eq_key:
+                eq = bs.loc[eq_key]
+                roe_series = (ni / eq) * 100
+                recent_roe = roe_series.head(5).dropna()
+                if len(recent_roe) > 0: roe_avg = round(recent_roe.mean(), 2)
+    except: pass
+    if roe_avg == 0: roe_avg = roe_ttm
+
+    cons_div = 0
+    try:
+        divs = stock.history(period="15y")['Dividends']
+        if not divs.empty:
+            yearly_divs = divs.groupby(divs.index.year).sum()
+            current_y = datetime.now().year
+            check_year = current_y - 1
+            if check_year not in yearly_divs.index or yearly_divs.loc[check_year] == 0:
+                if (check_year - 1) in yearly_divs.index and yearly_divs.loc[check_year - 1] > 0:
                     check_year -= 1
-        except:
-            if div_yield > 0: cons_div = 1
-
-        return {
-            "pe": pe, "pb": pb, "yield": div_yield, "yield_avg": yield_avg,
-            "eps_ttm": eps_ttm, "eps_avg": eps_avg, 
-            "roe_ttm": roe_ttm, "roe_avg": roe_avg, 
-            "roa": roa, "gross_margin": gross_margin, "op_margin": op_margin,
-            "rev_growth": rev_growth, "cons_div": cons_div,
-            "core_purity": core_purity, "gm_stability": gm_stability, "payout_ratio": payout_ratio
-        }
+            while check_year in yearly_divs.index and yearly_divs.loc[check_year] > 0:
+                cons_div += 1
+                check_year -= 1
+    except:
+        if div_yield > 0: cons_div = 1
+
+    return {
+        "eps_avg": eps_avg, "roe_avg": roe_avg, "cons_div": cons_div,
+        "core_purity": core_purity, "gm_stability": gm_stability
+    }
+
+def fetch_deep_stats(ticker, tier=2, basic=None):
+    """tier=1 只抓 info；tier=2 另抓財報 (若已有 Tier 1 結果可傳入 basic 略過 info)。"""
+    time.sleep(random.uniform(1.0, 3.0))
+    
+    try:
+        stock = yf.Ticker(ticker)
+        if basic is None:
+            try:
+                info = stock.info
+            except:
+                time.sleep(2)
+                stock = yf.Ticker(ticker)
+                info = stock.info
+            stats = fetch_basic_stats(info)
+        else:
+            stats = dict(basic)
+
+        if tier >= 2:
+            # 帶入 Tier 1 結果 (分層模式) 時才嚴格判斷，完整模式維持原本的暫代值行為
+            statement_stats = fetch_statement_stats(stock, stats, strict=basic is not None)
+            if statement_stats is None: return None
+            stats.update(statement_stats)
+            stats["tier2_at"] = tw_time.strftime('%Y-%m-%d')
+        else:
+            # Tier 1 只有 TTM 值，先當作平均值的暫代，Tier 2 會覆寫
+            stats.setdefault("eps_avg", stats['eps_ttm'])
+            stats.setdefault("roe_avg", stats['roe_ttm'])
+        stats["tier"] = tier
+        return stats
     except:
         return None
 
-tickers_to_enrich = list(processed_data.keys())
-enriched_count = 0
-count = 0
-total = len(tickers_to_enrich)
 MAX_WORKERS = 2 
-start_time = time.time()
 
-with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-    future_to_ticker = {executor.submit(fetch_deep_stats, t): t for t in tickers_to_enrich}
-    
-    for future in concurrent.futures.as_completed(future_to_ticker):
-        t = future_to_ticker[future]
-        count += 1
-        
-        if count % 50 == 0: time.sleep(10)
+def run_enrichment(jobs):
+    """jobs: {ticker: (tier, basic)}，回傳成功筆數。"""
+    enriched_count = 0
+    count = 0
+    total = len(jobs)
+    start_time = time.time()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        future_to_ticker = {executor.submit(fetch_deep_stats, t, tier, basic): t for t, (tier, basic) in jobs.items()}
         
-        if count % 5 == 0 or count == total:
-            elapsed = time.time() - start_time
-            avg_time = elapsed / count
-            remain = (total - count) * avg_time / 60
-            sys.stdout.write(f"\r   - 進度: {count}/{total} ({count/total*100:.1f}%) | 成功: {enriched_count} | 剩餘: ~{remain:.0f}分   ")
-            sys.stdout.flush()
+        for future in concurrent.futures.as_completed(future_to_ticker):
+            t = future_to_ticker[future]
+            count += 1
             
-        try:
-            stats = future.result()
-            if stats:
-                processed_data[t].update(stats)
-                
-                tags = []
-                is_golden = (processed_data[t]['eps_ttm'] >= 1 and 
-                             processed_data[t]['eps_avg'] >= 2 and
-                             processed_data[t]['yield_avg'] >= 5 and
-                             processed_data[t]['cons_div'] >= 10 and
-                             processed_data[t]['roe_avg'] >= 15 and
-                             processed_data[t]['core_purity'] >= 80 and
-                             processed_data[t]['gm_stability'] <= 5 and
-                             processed_data[t]['payout_ratio'] >= 60 and processed_data[t]['payout_ratio'] <= 100)
-                             
-                if is_golden: tags.append("🏆黃金存股")
-                if processed_data[t]['yield'] > 5: tags.append("💰高殖利")
-                if processed_data[t]['roe_avg'] > 15: tags.append("🔥高ROE")
-                if processed_data[t]['ma_bull']: tags.append("📈站上月線")
+            if count % 50 == 0: time.sleep(10)
+            
+            if count % 5 == 0 or count == total:
+                elapsed = time.time() - start_time
+                avg_time = elapsed / count
+                remain = (total - count) * avg_time / 60
+                sys.stdout.write(f"\r   - 進度: {count}/{total} ({count/total*100:.1f}%) | 成功: {enriched_count} | 剩餘: ~{remain:.0f}分   ")
+                sys.stdout.flush()
                 
-                processed_data[t]['tags'] = tags
-                enriched_count += 1
-        except: pass
-
-print(f"\n\n✅ 深度分析完成。成功獲取完整數據: {enriched_count}/{len(processed_data)} 檔")
-
-# 轉 JSON
-final_db = list(processed_data.values())
+            try:
+                stats = future.result()
+                if stats:
+                    stock_store.update(t, stats)
+                    enriched_count += 1
+            except: pass
+    return enriched_count
+
+tickers_to_enrich = list(stock_store.tickers)
+
+if ENRICH_MODE == "tiered":
+    print(f"   - Tier 1 (info): {len(tickers_to_enrich)} 檔")
+    run_enrichment({t: (1, None) for t in tickers_to_enrich})
+
+    prev_db = load_previous_db()
+    today = tw_time.date()
+
+    # Tier 1 也失敗 (info 抓不到) 的股票整筆沿用上次的基本面與財報欄位，照常參與標籤計算
+    carried = np.zeros(len(stock_store), dtype=bool)
+    for i in np.flatnonzero(stock_store['tier'] < 1):
+        prev = prev_db.get(stock_store['id'][i])
+        if not prev: continue
+        stock_store.update(stock_store.tickers[i], {k: prev[k] for k in TIER1_FIELDS + TIER2_FIELDS + ["tier2_at"] if k in prev})
+        carried[i] = True
+    if carried.any(): print(f"   - Tier 1 失敗，沿用上次資料: {int(carried.sum())} 檔")
+    gated = rule_mask(stock_store, TIER2_GATES)
+    tier2_jobs = {}
+    for i in np.flatnonzero(stock_store['tier'] >= 1):
+        t = stock_store.tickers[i]
+        prev = prev_db.get(stock_store['id'][i])
+        if gated[i] or is_tier2_due(stock_store['id'][i], prev, today):
+            tier2_jobs[t] = (2, {k: stock_store[k][i].item() for k in ("eps_ttm", "roe_ttm", "yield")})
+        else:
+            carry_forward_tier2(t, prev)
+
+    gate_desc = ', '.join(f"{g['field']} {g['op']} {g['value']}" for g in TIER2_GATES)
+    print(f"\n   - Tier 2 (財報): {len(tier2_jobs)} 檔 (門檻: {gate_desc})")
+    run_enrichment(tier2_jobs)
+
+    # Tier 2 失敗 (例如被限流) 的股票沿用上次財報欄位，避免標籤因暫時抓不到而消失
+    for t in tier2_jobs:
+        if stock_store['tier'][stock_store.index[t]] < 2:
+            carry_forward_tier2(t, prev_db.get(stock_store['id'][stock_store.index[t]]))
+else:
+    carried = np.zeros(len(stock_store), dtype=bool)
+    run_enrichment({t: (2, None) for t in tickers_to_enrich})
+
+apply_tags(stock_store, (stock_store['tier'] >= 1) | carried)
+enriched_count = int((stock_store['tier'] >= 2).sum())
+
+print(f"\n\n✅ 深度分析完成。成功獲取完整數據: {enriched_count}/{len(stock_store)} 檔")
+
+# 每日快照 (供歷史查詢，見 history.py)
 try:
-    json_db_str = json.dumps(final_db, cls=NpEncoder, ensure_ascii=False)
+    snapshot_path = write_snapshot(stock_store, [tag['label'] for tag in RULES['tags']], tw_time.strftime('%Y-%m-%d'))
+    print(f"🗄️ 已寫入每日快照: {snapshot_path}")
 except Exception as e:
-    print(f"JSON Error: {e}"); json_db_str = "[]"
+    print(f"Snapshot Error: {e}")
 
 # --- 最終統計報告 ---
 print("\n" + "="*35)
 print("📊 TW-PocketScreener V2.4.4 執行報告")
 print("="*35)
 print(f"📋 監測總數 : {len(all_stocks)} 檔")
-print(f"✅ 股價有效 : {len(processed_data)} 檔")
+print(f"✅ 股價有效 : {len(stock_store)} 檔")
 print(f"💎 財報完整 : {enriched_count} 檔")
 print("="*35 + "\n")
 
@@ -352,9 +585,9 @@ html_template = r'''<!DOCTYPE html>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>TW-PocketScreener V2.4 - 存股大師版</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://unpkg.com/lucide@latest"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/alpinejs/3.13.3/cdn.min.js" defer></script>
+    __TAILWIND__
+    <script src="__LUCIDE_SRC__"></script>
+    <script src="__ALPINE_SRC__" defer></script>
     <link href="https://fonts.googleapis.com/css2?family=Noto+Sans+TC:wght@400;500;700&display=swap" rel="stylesheet">
     <style>
         body { font-family: 'Noto Sans TC', sans-serif; -webkit-tap-highlight-color: transparent; }
@@ -725,26 +958,25 @@ html_template = r'''<!DOCTYPE html>
         function exitPrivacy() { switchView(lastView); }
 
         // --- 3. 選股工具邏輯 (Alpine.js) ---
+        // 資料以欄為單位輸出 ({欄位: [值...]})，載入時還原成每檔一個物件
+        function expandColumns(cols) {
+            const keys = Object.keys(cols), n = keys.length ? cols[keys[0]].length : 0, rows = new Array(n);
+            for (let i = 0; i < n; i++) { const r = {}; for (const k of keys) r[k] = cols[k][i]; rows[i] = r; }
+            return rows;
+        }
+        const RULES = __RULES_JSON__;
+        const OPS = { '>=': (a, b) => a >= b, '>': (a, b) => a > b, '<=': (a, b) => a <= b, '<': (a, b) => a < b, '==': (a, b) => a == b };
         function app() {
             return {
-                stocks: __JSON_DB__,
+                stocks: expandColumns(__JSON_DB__),
                 filters: [], newFilter: { type: 'roe_avg', operator: '>=', value: 15 }, showFilter: true, sortKey: 'yield_avg', sortDesc: true, displayCount: 20,
                 
                 applyDepositStrategy() {
-                    this.filters = [
-                        { type: 'eps_ttm', operator: '>=', value: 1 },   
-                        { type: 'eps_avg', operator: '>=', value: 2 },   
-                        { type: 'yield_avg', operator: '>=', value: 5 }, 
-                        { type: 'cons_div', operator: '>=', value: 10 }, 
-                        { type: 'roe_avg', operator: '>=', value: 15 },
-                        { type: 'core_purity', operator: '>=', value: 80 },
-                        { type: 'gm_stability', operator: '<=', value: 5 },
-                        { type: 'payout_ratio', operator: '>=', value: 60 },
-                        { type: 'payout_ratio', operator: '<=', value: 100 }
-                    ];
-                    this.sortKey = 'yield_avg';
+                    const strategy = RULES.strategies.golden;
+                    this.filters = strategy.rules.map(r => ({ type: r.field, operator: r.op, value: r.value }));
+                    this.sortKey = strategy.sort_key;
                     this.displayCount = 20;
-                    alert('✅ 已套用「黃金存股 8 法則」！(含純度/穩定度/發放率)');
+                    alert(`✅ 已套用「${strategy.label}」！(含純度/穩定度/發放率)`);
                 },
 
                 get filteredStocks() {
@@ -753,7 +985,7 @@ html_template = r'''<!DOCTYPE html>
                         res = res.filter(s => this.filters.every(f => {
                             let v = s[f.type];
                             if (f.type === 'ma_bull') return v === true;
-                            return f.operator === '>=' ? v >= parseFloat(f.value) : v <= parseFloat(f.value);
+                            return OPS[f.operator](v, parseFloat(f.value));
                         }));
                     }
                     return res.sort((a, b) => (this.sortDesc ? (b[this.sortKey] || -999) - (a[this.sortKey] || -999) : (a[this.sortKey] || -999) - (b[this.sortKey] || -999)));
@@ -769,9 +1001,19 @@ html_template = r'''<!DOCTYPE html>
 </body>
 </html>'''
 
-# 5. 進行替換 (這是最關鍵的一步，把 JSON 數據填入模板)
-final_html = html_template.replace("__JSON_DB__", json_db_str).replace("__UPDATE_TIME__", current_time_str)
+# 5. 產生 Tailwind CSS (需要 html_template，JS 資源已在第 0 步備妥)
+css_path = build_tailwind_css(html_template)
+asset_tags["__TAILWIND__"] = f'<link rel="stylesheet" href="{css_path}">' if css_path else TAILWIND_CDN
+print(f"🎨 CSS: {css_path or 'Tailwind CDN (未找到 CLI)'}")
+
+# 6. 進行替換 (股票資料不組成字串，寫檔時直接由 stock_store 串流寫入 __JSON_DB__ 的位置)
+html_head, html_tail = html_template.split("__JSON_DB__")
+def render(part):
+    for placeholder, value in asset_tags.items(): part = part.replace(placeholder, value)
+    return part.replace("__RULES_JSON__", json.dumps(RULES, ensure_ascii=False)).replace("__UPDATE_TIME__", current_time_str)
 
-# 6. 寫入檔案
+# 7. 寫入檔案
 with open("index.html", "w", encoding="utf-8") as f:
-    f.write(final_html)
+    f.write(render(html_head))
+    stock_store.write_json(f)
+    f.write(render(html_tail))
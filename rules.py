@@ -0,0 +1,35 @@
+# 篩選 / 標籤規則的共用載入與評估
+#
+# rules.json 由 main.py (標籤、Tier 2 門檻、網頁「一鍵套用」) 與 screen.py (選股 CLI) 共用；
+# 規則格式一律為 {"field", "op", "value"}，多條規則之間為 AND。
+
+import os
+import json
+import operator
+import numpy as np
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+OPERATORS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt, "==": operator.eq, "!=": operator.ne}
+
+def load_rules(path=RULES_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_strategy(name, path=RULES_PATH):
+    """回傳 (規則清單, 預設排序欄位)。"""
+    strategies = load_rules(path)['strategies']
+    if name not in strategies: raise KeyError(f"未知策略: {name} (可用: {', '.join(strategies)})")
+    strategy = strategies[name]
+    return strategy['rules'], strategy.get('sort_key')
+
+def rule_mask(store, rules, cache=None):
+    """把一組 AND 規則轉成整批資料的 NumPy 布林遮罩；cache 可跨多組規則共用相同條件的結果。"""
+    mask = np.ones(len(store), dtype=bool)
+    for r in rules:
+        key = (r['field'], r['op'], float(r['value']))
+        m = cache.get(key) if cache is not None else None
+        if m is None:
+            m = OPERATORS[r['op']](store[r['field']], float(r['value']))
+            if cache is not None: cache[key] = m
+        mask &= m
+    return mask
@@ -0,0 +1,120 @@
+# 本地選股引擎 / CLI
+#
+# 以每日快照 (見 history.py) 為資料來源，條件語法與網頁篩選相同：
+#   python screen.py "roe_avg >= 15" "gm_stability <= 5" ma_bull --sort yield_avg --limit 20
+#   python screen.py --strategy golden
+#   python screen.py --screens my_screens.json --json
+#
+# my_screens.json 格式：
+#   {"高ROE站上月線": {"filters": ["roe_avg >= 15", "ma_bull"], "sort": "roe_avg", "desc": true, "limit": 20}}
+
+import re
+import json
+import argparse
+import numpy as np
+
+from history import HISTORY_DIR, list_dates, load_column, load_meta
+from rules import load_strategy, rule_mask
+
+BOOL_FIELDS = {"ma_bull"}  # 只有布林欄位可用 'ma_bull' / '!ma_bull' 的簡寫
+SORT_KEYS = ["yield_avg", "roe_avg", "eps_avg", "core_purity", "cons_div", "yield", "id"]
+SORT_MISSING = -999  # 與網頁排序一致：缺值視為 -999
+
+_EXPR = re.compile(r"^\s*(!?)\s*(\w+)\s*(?:(>=|<=|==|!=|>|<)\s*(-?\d+(?:\.\d+)?))?\s*$")
+
+def compile_filter(expr):
+    """'roe_avg >= 15' / 'ma_bull' / '!ma_bull' -> {"field", "op", "value"}。"""
+    m = _EXPR.match(expr)
+    if not m: raise ValueError(f"無法解析的條件: {expr!r}")
+    neg, field, op, value = m.groups()
+    if op is None:
+        if field not in BOOL_FIELDS: raise ValueError(f"{field} 不是布林欄位，請加上比較條件 (例如 '{field} >= 15'): {expr!r}")
+        return {"field": field, "op": "!=" if neg else "==", "value": 1}
+    if neg: raise ValueError(f"'!' 只能用於布林欄位: {expr!r}")
+    return {"field": field, "op": op, "value": float(value)}
+
+class Dataset:
+    """快照欄位 (mmap) 加上排序索引快取。"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.ids = columns['id']
+        self._sorted = {}
+
+    @classmethod
+    def from_snapshot(cls, date=None, root=HISTORY_DIR):
+        dates = list_dates(None, date, root)
+        if not dates: raise FileNotFoundError(f"{root} 中沒有快照")
+        meta = load_meta(dates[-1], root)
+        names = ["id"] + meta["fields"]
+        ds = cls({name: load_column(dates[-1], name, root) for name in names})
+        ds.date = dates[-1]
+        return ds
+
+    def __len__(self): return len(self.ids)
+
+    def __getitem__(self, field):
+        if field not in self.columns: raise KeyError(f"未知欄位: {field}")
+        return self.columns[field]
+
+    def sorted_index(self, key):
+        """依 key 由小到大的列索引 (首次使用時建立後快取)。"""
+        if key not in self._sorted:
+            col = self[key]
+            if col.dtype.kind == 'f': col = np.where(np.isnan(col) | (col == 0), SORT_MISSING, col)
+            self._sorted[key] = np.argsort(col, kind='stable')
+        return self._sorted[key]
+
+    def screen(self, rules, sort=None, desc=True, limit=None, cache=None):
+        """回傳符合條件的股票代號 (依 sort 排序)。"""
+        mask = rule_mask(self, rules, cache)
+        if sort is None:
+            rows = np.flatnonzero(mask)
+        else:
+            order = self.sorted_index(sort)
+            if desc: order = order[::-1]
+            rows = order[mask[order]]
+        if limit is not None: rows = rows[:limit]
+        return self.ids[rows].tolist()
+
+    def run_screens(self, screens):
+        """一次執行多組選股條件；相同條件只計算一次遮罩。"""
+        cache = {}
+        return {name: self.screen([compile_filter(f) for f in s.get("filters", [])], s.get("sort"), s.get("desc", True), s.get("limit"), cache)
+                for name, s in screens.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="以每日快照執行選股條件")
+    parser.add_argument("filters", nargs="*", help="例如 'roe_avg >= 15'、ma_bull")
+    parser.add_argument("--strategy", help="套用 rules.json 中的策略，例如 golden")
+    parser.add_argument("--screens", help="批次執行的選股條件 JSON 檔")
+    parser.add_argument("--sort", choices=SORT_KEYS)
+    parser.add_argument("--asc", action="store_true", help="由小到大排序")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--date", help="使用此日期 (含) 以前最新的快照")
+    parser.add_argument("--root", default=HISTORY_DIR)
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    args = parser.parse_args()
+
+    try:
+        ds = Dataset.from_snapshot(args.date, args.root)
+        if args.screens:
+            with open(args.screens, "r", encoding="utf-8") as f:
+                results = ds.run_screens(json.load(f))
+        else:
+            rules, sort = [], args.sort
+            if args.strategy:
+                rules, strategy_sort = load_strategy(args.strategy)
+                sort = sort or strategy_sort
+            rules = rules + [compile_filter(f) for f in args.filters]
+            results = {"screen": ds.screen(rules, sort, not args.asc, args.limit)}
+    except (KeyError, ValueError, FileNotFoundError) as e:
+        # KeyError 的 str() 會多一層引號，直接取訊息
+        parser.error(e.args[0] if isinstance(e, KeyError) else str(e))
+
+    if args.json:
+        print(json.dumps({"date": ds.date, "results": results}, ensure_ascii=False))
+    else:
+        print(f"📅 快照: {ds.date}")
+        for name, ids in results.items():
+            print(f"{name} ({len(ids)}): {' '.join(ids)}")